@@ -3,16 +3,24 @@ Tournament Tracker - OP.GG MCP API
 Fetches player data from OP.GG, calculates team scores, and writes to Google Sheets.
 """
 
-import time
+import os
 import re
+import json
+import time
+import threading
+import orjson
 import requests
 from typing import Tuple, List, Dict
 from dataclasses import dataclass, field
-from urllib.parse import quote, unquote
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, unquote_plus
 
 import gspread
 from google.oauth2.service_account import Credentials
 from googleapiclient.discovery import build
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # ============================================================================
 # CONFIGURATION
@@ -20,11 +28,27 @@ from googleapiclient.discovery import build
 
 SERVICE_ACCOUNT_FILE = "gen-lang-client-0890515948-9d584c688878.json"
 SOURCE_SHEET_ID = "1d5Fps2yHHfRwIy9KepptT3QsuG8m2c64bVCEeY-Jgds"
+SOURCE_RANGE = "A1:ZZ1000"  # No sheet name, so this reads the first tab (form responses)
 TARGET_SHEET_ID = "1_lLJHsz4tFLfDoeZw81U_-iA7U6VdkvCnVVwpg001jk"
 TARGET_SHEET_NAME = "[#4.0] Teams"  # Production sheet
 
 OPGG_MCP_URL = "https://mcp-api.op.gg/mcp"
 REGIONS = ["eune", "euw", "tr", "ru", "na", "kr"]
+FETCH_WORKERS = 5  # Accounts looked up concurrently
+OPGG_MAX_IN_FLIGHT = 4  # Concurrent MCP requests, to stay polite to OP.GG
+
+CACHE_FILE = "cache.json"  # Account regions resolved on earlier runs
+NEGATIVE_CACHE_TTL = 24 * 60 * 60  # Seconds before a not-found account is searched again
+
+# Shared keep-alive session so region probes reuse one TLS connection
+SESSION = requests.Session()
+SESSION.headers.update({"Connection": "keep-alive", "Accept-Encoding": "gzip"})
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=8, pool_maxsize=32,
+    max_retries=Retry(total=2, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=["POST"]),
+))
+_opgg_slots = threading.BoundedSemaphore(OPGG_MAX_IN_FLIGHT)
 
 LP_TABLE = {
     "IRON": {"IV": 0, "III": 100, "II": 200, "I": 300},
@@ -36,10 +60,33 @@ LP_TABLE = {
     "DIAMOND": {"IV": 2400, "III": 2500, "II": 2600, "I": 2700},
     "MASTER": 2800, "GRANDMASTER": 3000, "CHALLENGER": 3300,
 }
+# LP_TABLE flattened to (tier, division) -> base LP; apex tiers accept any division
+_LP_FLAT = {
+    (tier, div): base[div] if isinstance(base, dict) else base
+    for tier, base in LP_TABLE.items()
+    for div in (base if isinstance(base, dict) else ("", "IV", "III", "II", "I"))
+}
+_APEX_TIERS = ("MASTER", "GRANDMASTER", "CHALLENGER")
+_APEX_SCORE = LP_TABLE["MASTER"]  # Lowest apex total, and the most any lower tier can reach
 
 TIER_ORDER = ["IRON", "BRONZE", "SILVER", "GOLD", "PLATINUM", "EMERALD", 
               "DIAMOND", "MASTER", "GRANDMASTER", "CHALLENGER"]
+TIER_INDEX = {t: i for i, t in enumerate(TIER_ORDER)}
 DIV_ORDER = {"IV": 0, "III": 1, "II": 2, "I": 3, "4": 0, "3": 1, "2": 2, "1": 3}
+DIV_ROMAN = {1: "I", 2: "II", 3: "III", 4: "IV"}  # OP.GG reports divisions as 1-4
+
+# Precompiled regex patterns for OP.GG responses and URLs, Riot IDs and Drive links
+# Outer groups: 1 = current solo rank (2-4), 5 = split top tier (6-8), 9 = past season (10-12)
+_RE_ANY = re.compile(
+    r'(LeagueStat\("SOLORANKED",TierInfo\("([A-Z]+)",(\d+),(\d+))'
+    r'|(RankEntrie1\("[A-Z]+",RankInfo\("([A-Z]+)",(\d+),(\d+))'
+    r'|(PreviousSeason\(\d+,TierInfo\d*\("([A-Z]+)",(\d+)(?:,(\d+))?)'
+)
+_GROUP_SOLO, _GROUP_ENTRY = 1, 5
+_RE_OPGG_URL = re.compile(r'op\.gg/lol/summoners/([a-z]+)/([^/?#]+)-([^/?#]+)')
+_RE_PAREN_REGION = re.compile(r'\s*\(([^)]+)\)\s*$')
+_RE_DRIVE_ID_PARAM = re.compile(r'[?&]id=([a-zA-Z0-9_-]+)')
+_RE_DRIVE_FILE_PATH = re.compile(r'/file/d/([a-zA-Z0-9_-]+)')
 
 # ============================================================================
 # DATA CLASSES
@@ -80,13 +127,14 @@ def get_credentials():
                 "https://www.googleapis.com/auth/drive"]
     )
 
+@lru_cache(maxsize=4096)
 def parse_riot_id(riot_id: str) -> Tuple[str, str, str]:
     """Parse 'GameName#Tag' or 'GameName#Tag (region)' into (name, tag, region_hint)."""
     riot_id = riot_id.strip()
     
     # Extract parenthesized region hint, e.g. "Spoon#loh (euwest)" -> hint="euwest"
     region_hint = ""
-    paren_match = re.search(r'\s*\(([^)]+)\)\s*$', riot_id)
+    paren_match = _RE_PAREN_REGION.search(riot_id)
     if paren_match:
         region_hint = paren_match.group(1).strip().lower()
         riot_id = riot_id[:paren_match.start()].strip()
@@ -97,26 +145,28 @@ def parse_riot_id(riot_id: str) -> Tuple[str, str, str]:
             return parts[0].strip(), parts[1].strip() if len(parts) > 1 else "", region_hint
     return riot_id, "", region_hint
 
+@lru_cache(maxsize=4096)
 def parse_opgg_url(url: str) -> Tuple[str, str, str]:
     """Parse an OP.GG URL into (name, tag, region). Returns ('','','') on failure."""
-    match = re.search(r'op\.gg/lol/summoners/([a-z]+)/([^/?#]+)-([^/?#]+)', url)
+    match = _RE_OPGG_URL.search(url)
     if match:
         region = match.group(1)
-        name = unquote(match.group(2).replace("+", " "))
-        tag = unquote(match.group(3).replace("+", " "))
+        name = unquote_plus(match.group(2))
+        tag = unquote_plus(match.group(3))
         return name, tag, region
     return "", "", ""
 
 def get_opgg_url(name: str, tag: str, region: str) -> str:
     return f"https://op.gg/lol/summoners/{region}/{quote(name)}-{quote(tag)}"
 
+@lru_cache(maxsize=4096)
 def convert_drive_url(url: str) -> str:
     """Convert Google Drive URL to direct image URL for =IMAGE() formula."""
     if not url:
         return ""
     # Extract file ID from Drive URLs
-    for pattern in [r'[?&]id=([a-zA-Z0-9_-]+)', r'/file/d/([a-zA-Z0-9_-]+)']:
-        match = re.search(pattern, url)
+    for pattern in (_RE_DRIVE_ID_PARAM, _RE_DRIVE_FILE_PATH):
+        match = pattern.search(url)
         if match:
             return f"https://lh3.googleusercontent.com/d/{match.group(1)}"
     return url
@@ -130,11 +180,12 @@ def format_rank(tier: str, division: str) -> str:
 def calculate_lp(tier: str, division: str, lp: int) -> int:
     if not tier or tier == "UNRANKED":
         return 0
-    tier = tier.upper()
-    if tier in ["MASTER", "GRANDMASTER", "CHALLENGER"]:
-        return LP_TABLE.get(tier, 0) + lp
-    tier_data = LP_TABLE.get(tier)
-    return tier_data.get(division, 0) + lp if isinstance(tier_data, dict) else 0
+    base = _LP_FLAT.get((tier.upper(), division or ""))
+    return base + lp if base is not None else 0
+
+def _rank_score(tier: str, div: int, lp: int) -> int:
+    """Total LP for an OP.GG tier/division (1-4) pair, used to compare peak candidates."""
+    return calculate_lp(tier, DIV_ROMAN.get(div, "IV"), lp)
 
 def compare_ranks(rank1: str, rank2: str) -> int:
     """Return 1 if rank1 > rank2, -1 if rank1 < rank2, 0 if equal."""
@@ -148,14 +199,58 @@ def compare_ranks(rank1: str, rank2: str) -> int:
     d1 = p1[1] if len(p1) > 1 else "I"
     d2 = p2[1] if len(p2) > 1 else "I"
     
-    ti1 = TIER_ORDER.index(t1) if t1 in TIER_ORDER else -1
-    ti2 = TIER_ORDER.index(t2) if t2 in TIER_ORDER else -1
+    ti1 = TIER_INDEX.get(t1, -1)
+    ti2 = TIER_INDEX.get(t2, -1)
     
     if ti1 != ti2:
         return 1 if ti1 > ti2 else -1
     di1, di2 = DIV_ORDER.get(d1, 0), DIV_ORDER.get(d2, 0)
     return 1 if di1 > di2 else (-1 if di1 < di2 else 0)
 
+# ============================================================================
+# ACCOUNT CACHE
+# ============================================================================
+
+# "name#tag" (lowercase) -> {"region", "peak_rank", "opgg_url", "ts"} or {"not_found": True, "regions", "ts"}
+_account_cache: Dict[str, Dict] = {}
+
+def _cache_key(name: str, tag: str) -> str:
+    return f"{name.lower()}#{tag.lower()}"
+
+def _valid_cache_entry(entry) -> bool:
+    if not isinstance(entry, dict):
+        return False
+    if entry.get("not_found"):
+        return isinstance(entry.get("ts"), (int, float)) and isinstance(entry.get("regions"), list)
+    return isinstance(entry.get("region"), str) and bool(entry["region"])
+
+def load_cache():
+    """Load the account cache from CACHE_FILE. A missing or corrupt file starts empty."""
+    _account_cache.clear()
+    try:
+        with open(CACHE_FILE, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return
+    if not isinstance(data, dict):
+        print(f"  Warning: ignoring malformed {CACHE_FILE}")
+        return
+    _account_cache.update((k, v) for k, v in data.items() if _valid_cache_entry(v))
+
+def save_cache():
+    # Write to a temp file and swap it in, so an overlapping run never reads a partial file
+    tmp_file = f"{CACHE_FILE}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(_account_cache, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_file, CACHE_FILE)
+    except OSError as e:
+        print(f"  Warning: could not save cache: {e}")
+        try:
+            os.remove(tmp_file)
+        except OSError:
+            pass
+
 # ============================================================================
 # OP.GG API FUNCTIONS
 # ============================================================================
@@ -175,10 +270,12 @@ def fetch_from_opgg(game_name: str, tag: str, region: str) -> Dict:
         }
     }
     try:
-        r = requests.post(OPGG_MCP_URL, json=payload, timeout=20)
+        with _opgg_slots:
+            r = SESSION.post(OPGG_MCP_URL, data=orjson.dumps(payload),
+                             headers={"Content-Type": "application/json"}, timeout=20)
         if r.status_code != 200:
             return None
-        result = r.json()
+        result = orjson.loads(r.content)
         content = result.get("result", {}).get("content", [])
         return {"text": content[0].get("text", "")} if content else None
     except:
@@ -187,69 +284,74 @@ def fetch_from_opgg(game_name: str, tag: str, region: str) -> Dict:
 def parse_opgg_response(text: str) -> Dict:
     """Parse OP.GG response for rank data."""
     text = text.replace("\n", "").replace("\r", "")
-    result = {"current_rank": "UNRANKED", "current_lp": 0, "peak_rank": "UNRANKED", "peak_lp": 0}
-    
-    # Current solo rank (handles both formats)
-    # Format 1: LeagueStat("SOLORANKED",TierInfo("GOLD",4,12))
-    # Format 2: LeagueStat("SOLORANKED",TierInfo("GOLD",4,12,null,...))
-    match = re.search(r'LeagueStat\("SOLORANKED",TierInfo\("([A-Z]+)",(\d+),(\d+)', text)
-    if match:
-        tier, div, lp = match.group(1), int(match.group(2)), int(match.group(3))
-        div_roman = {1: "I", 2: "II", 3: "III", 4: "IV"}.get(div, "IV")
-        result["current_rank"] = format_rank(tier, div_roman)
-        result["current_lp"] = lp
-        
-    # Determine Peak Rank (Max of all sources)
-    best = "UNRANKED"
-    best_lp = 0
-    best_total = 0  # Total LP used for comparison
-    
-    # Use current rank as starting point for peak
-    if result["current_rank"] != "UNRANKED":
-        best = result["current_rank"]
-        best_lp = result["current_lp"]
-        parts = best.split()
-        best_total = calculate_lp(parts[0], parts[1] if len(parts) > 1 else "I", best_lp)
-    
-    # Check current split's "Top Tier" (RankEntrie1 format)
-    # Format: RankEntrie1("SOLORANKED",RankInfo("SILVER",2,38,...))
-    for tier, div, lp in re.findall(r'RankEntrie1\("[A-Z]+",RankInfo\("([A-Z]+)",(\d+),(\d+)', text):
-        div_roman = {1: "I", 2: "II", 3: "III", 4: "IV"}.get(int(div), "IV")
-        rank = format_rank(tier, div_roman)
-        total = calculate_lp(tier, div_roman, int(lp))
-        if total > best_total:
-            best = rank
-            best_lp = int(lp)
-            best_total = total
-            
-    # Check historical seasons (PreviousSeason format)
-    # Format 1: PreviousSeason(31,TierInfo1("SILVER",3))  
-    # Format 2: PreviousSeason(21,TierInfo("GRANDMASTER",1,640,null,...))
-    for match in re.finditer(r'PreviousSeason\(\d+,TierInfo\d*\("([A-Z]+)",(\d+)(?:,(\d+))?', text):
-        tier, div = match.group(1), int(match.group(2))
-        lp = int(match.group(3)) if match.group(3) else 0
-        div_roman = {1: "I", 2: "II", 3: "III", 4: "IV"}.get(div, "IV")
-        rank = format_rank(tier, div_roman)
-        total = calculate_lp(tier, div_roman, lp)
-        if total > best_total:
-            best = rank
-            best_lp = lp
-            best_total = total
-    
-    result["peak_rank"] = best
-    result["peak_lp"] = best_lp
+    result = {"current_rank": "UNRANKED", "current_lp": 0,
+              "peak_rank": "UNRANKED", "peak_lp": 0, "peak_total": 0}
+    
+    # Determine Peak Rank (Max of all sources). Candidates are kept as raw
+    # tier/division/LP and only formatted once the best one is known.
+    cur_tier, cur_div, cur_lp = None, 0, 0
+    best_tier, best_div, best_lp = None, 0, 0
+    best_score = 0  # Total LP used for comparison
+    
+    # Single pass over all rank sources, dispatching on the outer group that matched:
+    #   1 (solo):  LeagueStat("SOLORANKED",TierInfo("GOLD",4,12)) or TierInfo("GOLD",4,12,null,...)
+    #   5 (entry): RankEntrie1("SOLORANKED",RankInfo("SILVER",2,38,...)) - current split's "Top Tier"
+    #   9 (prev):  PreviousSeason(31,TierInfo1("SILVER",3)) or PreviousSeason(21,TierInfo("GRANDMASTER",1,640,null,...))
+    for match in _RE_ANY.finditer(text):
+        kind = match.lastindex
+        if kind == _GROUP_SOLO:
+            if cur_tier is None:
+                cur_tier, cur_div, cur_lp = match.group(2), int(match.group(3)), int(match.group(4))
+            continue
+        tier = match.group(6) if kind == _GROUP_ENTRY else match.group(10)
+        # Below Master LP caps at Diamond I 100 LP, so once the best is apex those can't win
+        if best_score >= _APEX_SCORE and tier not in _APEX_TIERS:
+            continue
+        if kind == _GROUP_ENTRY:
+            div, lp = int(match.group(7)), int(match.group(8))
+        else:
+            div = int(match.group(11))
+            lp = int(match.group(12)) if match.group(12) else 0
+        score = _rank_score(tier, div, lp)
+        if score > best_score:
+            best_tier, best_div, best_lp, best_score = tier, div, lp, score
+    
+    if cur_tier:
+        result["current_rank"] = format_rank(cur_tier, DIV_ROMAN.get(cur_div, "IV"))
+        result["current_lp"] = cur_lp
+        # Current rank wins ties against split/season entries
+        if result["current_rank"] != "UNRANKED":
+            score = _rank_score(cur_tier, cur_div, cur_lp)
+            if score >= best_score:
+                best_tier, best_div, best_lp, best_score = cur_tier, cur_div, cur_lp, score
+    
+    if best_tier:
+        result["peak_rank"] = format_rank(best_tier, DIV_ROMAN.get(best_div, "IV"))
+        result["peak_lp"] = best_lp
+        result["peak_total"] = best_score
     return result
 
 REGION_ALIASES = {"euwest": "euw", "eueast": "eune", "euwe": "euw", "west": "euw", "east": "eune"}
 
+def _parse_account(account_str: str) -> Tuple[str, str, str]:
+    """Parse a Riot ID or OP.GG URL into (name, tag, region or region hint)."""
+    if "op.gg/" in account_str:
+        return parse_opgg_url(account_str)
+    return parse_riot_id(account_str)
+
+def _account_key(account_str: str) -> str:
+    """Normalized 'name#tag' key for a Riot ID or OP.GG URL, '' if it can't be parsed."""
+    name, tag, _ = _parse_account(account_str)
+    return _cache_key(name, tag) if name and tag else ""
+
 def _lookup_account(account_str: str) -> Dict:
     """Look up a single account on OP.GG. Returns rank data dict or None."""
     if not account_str or not account_str.strip():
         return None
     
-    region_hint = ""
+    url_region = region_hint = ""
     if "op.gg/" in account_str:
-        name, tag, region_hint = parse_opgg_url(account_str)
+        name, tag, url_region = parse_opgg_url(account_str)
     else:
         name, tag, region_hint = parse_riot_id(account_str)
     
@@ -259,7 +361,16 @@ def _lookup_account(account_str: str) -> Dict:
     if region_hint:
         region_hint = REGION_ALIASES.get(region_hint, region_hint)
     
+    key = _cache_key(name, tag)
+    cached = _account_cache.get(key)
+    
     regions = []
+    if url_region:
+        # OP.GG URLs usually carry the right region; the search below is the fallback
+        regions.append(url_region)
+    if cached and not cached.get("not_found"):
+        # Region found on an earlier run, so normally only the ranks need refreshing
+        regions.append(cached["region"])
     if region_hint:
         regions.append(region_hint)
     if tag.lower() in REGIONS:
@@ -267,9 +378,16 @@ def _lookup_account(account_str: str) -> Dict:
     regions.extend(REGIONS)
     regions = list(dict.fromkeys(regions))
     
+    # A recent miss only counts if it already covered every region we'd try now
+    if (cached and cached.get("not_found") and set(regions) <= set(cached["regions"])
+            and time.time() - cached["ts"] < NEGATIVE_CACHE_TTL):
+        return None
+    
+    failed = False
     for region in regions:
         resp = fetch_from_opgg(name, tag, region)
         if not resp:
+            failed = True
             continue
         
         data = parse_opgg_response(resp["text"])
@@ -280,43 +398,35 @@ def _lookup_account(account_str: str) -> Dict:
         data["name"] = name
         data["tag"] = tag
         data["region"] = region
-        data["clean_id"] = f"{name}#{tag}"
         data["opgg_url"] = get_opgg_url(name, tag, region)
         
-        # Pre-calculate total LP from peak
-        if data["peak_rank"] != "UNRANKED":
-            parts = data["peak_rank"].split()
-            data["total_lp"] = calculate_lp(parts[0], parts[1] if len(parts) > 1 else "I", data["peak_lp"])
-        else:
-            data["total_lp"] = 0
+        # Total LP comes from the peak rank
+        data["total_lp"] = data["peak_total"]
         
+        _account_cache[key] = {"region": region, "peak_rank": data["peak_rank"],
+                               "opgg_url": data["opgg_url"], "ts": time.time()}
         return data
     
+    if not failed:
+        # Every region answered without the account; don't search them again for a while.
+        # After a network failure any existing entry is left as it was.
+        _account_cache[key] = {"not_found": True, "regions": regions, "ts": time.time()}
     return None
 
-def fetch_player(player: Player) -> Player:
-    """Fetch and populate player rank data from both accounts, using the better peak."""
+def fetch_player(player: Player, lookups: Dict[str, Dict]) -> Player:
+    """Populate player rank data from both accounts' lookups, using the better peak."""
     if not player.main_account.strip():
-        print(f"  [Empty]: Field is empty")
         return player
     
     # Pre-clean display name for logging
-    if "op.gg/" in player.main_account:
-        n, t, _ = parse_opgg_url(player.main_account)
-        if n and t:
-            display_name = f"{n}#{t}"
-    else:
-        n, t, _ = parse_riot_id(player.main_account)
-        if n and t:
-            display_name = f"{n}#{t}"
-        else:
-            display_name = player.main_account.strip()
+    display_name = player.main_account.strip()
+    n, t, _ = _parse_account(player.main_account)
+    if n and t:
+        display_name = f"{n}#{t}"
     
-    print(f"  {display_name}:", end=" ")
-    
-    # Look up both accounts
-    main_data = _lookup_account(player.main_account)
-    tourn_data = _lookup_account(player.tournament_account) if player.tournament_account.strip() else None
+    # Results for both accounts, resolved up front by _account_key
+    main_data = lookups.get(_account_key(player.main_account))
+    tourn_data = lookups.get(_account_key(player.tournament_account)) if player.tournament_account.strip() else None
     
     # Pick the account with the better peak rank for scoring
     best = None
@@ -328,7 +438,7 @@ def fetch_player(player: Player) -> Player:
         best = tourn_data
     
     if not best:
-        print("Not found")
+        print(f"  {display_name}: Not found")
         return player
     
     # Use the best peak data for scoring
@@ -339,9 +449,10 @@ def fetch_player(player: Player) -> Player:
     player.region = best["region"]
     
     # Clean display names and set OP.GG links
+    # Lookups are shared between slots, so names keep this slot's own spelling
     if main_data:
-        player.main_account = main_data["clean_id"]
-        player.opgg_main = main_data["opgg_url"]
+        player.main_account = f"{n}#{t}"
+        player.opgg_main = get_opgg_url(n, t, main_data["region"])
     else:
         # Clean even if not found
         if "op.gg/" in player.main_account:
@@ -354,8 +465,9 @@ def fetch_player(player: Player) -> Player:
                 player.main_account = f"{n}#{t}"
     
     if tourn_data:
-        player.tournament_account = tourn_data["clean_id"]
-        player.opgg_tournament = tourn_data["opgg_url"]
+        tn, tt, _ = _parse_account(player.tournament_account)
+        player.tournament_account = f"{tn}#{tt}"
+        player.opgg_tournament = get_opgg_url(tn, tt, tourn_data["region"])
     elif player.tournament_account.strip():
         if "op.gg/" in player.tournament_account:
             n, t, r = parse_opgg_url(player.tournament_account)
@@ -370,24 +482,27 @@ def fetch_player(player: Player) -> Player:
     
     src = "tournament" if best == tourn_data and main_data else "main"
     if best == tourn_data and main_data:
-        print(f"{player.current_rank} ({player.current_lp} LP) | Peak: {player.peak_rank} (from tournament acc)")
+        print(f"  {display_name}: {player.current_rank} ({player.current_lp} LP) | Peak: {player.peak_rank} (from tournament acc)")
     else:
-        print(f"{player.current_rank} ({player.current_lp} LP) | Peak: {player.peak_rank}")
+        print(f"  {display_name}: {player.current_rank} ({player.current_lp} LP) | Peak: {player.peak_rank}")
     return player
 
 # ============================================================================
 # GOOGLE SHEETS FUNCTIONS
 # ============================================================================
 
-def read_teams(creds) -> List[Team]:
+def read_teams(sheets) -> List[Team]:
     """Read team registrations from the source sheet."""
-    gc = gspread.authorize(creds)
-    records = gc.open_by_key(SOURCE_SHEET_ID).sheet1.get_all_values()
+    response = sheets.spreadsheets().values().get(
+        spreadsheetId=SOURCE_SHEET_ID, range=SOURCE_RANGE, majorDimension="ROWS"
+    ).execute()
+    records = response.get("values", [])
     if not records:
         return []
     
     headers = records[0]
-    data_rows = records[1:]
+    # Skip responses an organizer cleared; later rows are still registrations
+    data_rows = [row_data for row_data in records[1:] if any(cell.strip() for cell in row_data)]
     
     # Key for the logo correction column
     LOGO_2_KEY = "Komandas Logo (IZMANTO ŠO TIKAI TĀDOS GADĪJUMOS, JA EDITOJOT RESPONSE NEJAUŠI IELIKI NEPAREIZU BILDI PIRMAJĀ KOMANDAS LOGO JAUTĀJUMĀ!!!)"
@@ -427,101 +542,125 @@ def read_teams(creds) -> List[Team]:
         teams.append(team)
     return teams
 
-def write_teams(creds, teams: List[Team]):
-    """Write team data to the target sheet."""
-    gc = gspread.authorize(creds)
+def _cell_range(row: int, cols: str) -> str:
+    """A1 range for consecutive columns of one row, e.g. (5, "KLM") -> 'K5:M5'."""
+    return f"{cols[0]}{row}" if len(cols) == 1 else f"{cols[0]}{row}:{cols[-1]}{row}"
+
+def _cells_match(grid: List[List], top_row: int, row: int, cols: str, values: List) -> bool:
+    """Check planned values against a grid read from column C starting at `top_row`."""
+    cells = grid[row - top_row] if 0 <= row - top_row < len(grid) else []
+    for col, value in zip(cols, values):
+        c = ord(col) - ord("C")
+        if str(cells[c] if c < len(cells) else "") != str(value):
+            return False
+    return True
+
+def _mk_cell(sheet_id: int, row: int, col: int, values: List[Dict]) -> Dict:
+    """updateCells request writing `values` (userEnteredValue objects) rightwards from 1-based `row`, 0-based `col`."""
+    return {
+        "updateCells": {
+            "range": {"sheetId": sheet_id, "startRowIndex": row-1, "endRowIndex": row,
+                      "startColumnIndex": col, "endColumnIndex": col + len(values)},
+            "rows": [{"values": [{"userEnteredValue": v} for v in values]}],
+            "fields": "userEnteredValue",
+        }
+    }
+
+def write_teams(gc, sheets, teams: List[Team]):
+    """Write team data to the target sheet, skipping cells that already hold the same value."""
     worksheet = gc.open_by_key(TARGET_SHEET_ID).worksheet(TARGET_SHEET_NAME)
-    sheets = build('sheets', 'v4', credentials=creds)
     sheet_id = worksheet.id
     
     TEAM_START, ROWS_PER_TEAM = 5, 7
     
+    # Read the whole team block once (formulas, not rendered values) to diff against
+    last_row = TEAM_START + len(teams) * ROWS_PER_TEAM - 1
+    current = worksheet.get(f"C{TEAM_START}:S{last_row}", value_render_option="FORMULA") if teams else []
+    
+    # Every team goes into one values batch and one formula batch
+    all_value_updates = []
+    all_formula_reqs = []
+    
     for idx, team in enumerate(teams, 1):
-        print(f"  Writing team {idx}: {team.name}")
         row = TEAM_START + (idx - 1) * ROWS_PER_TEAM
+        pending = len(all_value_updates) + len(all_formula_reqs)
         
-        # Batch update text values
-        updates = [
-            {"range": f"C{row}", "values": [[team.name]]},
-            {"range": f"C{row + 5}", "values": [[f"[{team.short_name}]"]]},
-            {"range": f"S{row}", "values": [[team.regular_score]]},
-            {"range": f"S{row + 5}", "values": [[f"[{team.total_score}]"]]}, # Total score in brackets
+        # Text values as (row, columns, values)
+        value_cells = [
+            (row, "C", [team.name]),
+            (row + 5, "C", [f"[{team.short_name}]"]),
+            (row, "S", [team.regular_score]),
+            (row + 5, "S", [f"[{team.total_score}]"]),  # Total score in brackets
         ]
         
+        # Hyperlinks for L (tournament) and M (main), keyed by column index
+        player_links = []
         for i, p in enumerate(team.players):
             r = row + i
-            updates.extend([
-                {"range": f"K{r}", "values": [[p.discord]]},
-                {"range": f"L{r}", "values": [[p.tournament_account]]},
-                {"range": f"M{r}", "values": [[p.main_account]]},
-                {"range": f"O{r}", "values": [[p.peak_rank]]},
-                {"range": f"Q{r}", "values": [[p.current_rank]]},
-                {"range": f"R{r}", "values": [[p.total_lp]]},
-            ])
+            links = {}
+            if p.opgg_tournament:
+                links[11] = f'=HYPERLINK("{p.opgg_tournament}","{p.tournament_account.replace(chr(34), chr(39))}")'
+            if p.opgg_main:
+                links[12] = f'=HYPERLINK("{p.opgg_main}","{p.main_account.replace(chr(34), chr(39))}")'
+            
+            # L and M end up holding the hyperlink formula when there is one. Rewriting
+            # K:M as plain text clobbers the links, so they must be re-sent too.
+            names_stale = not _cells_match(current, TEAM_START, r, "KLM",
+                                           [p.discord, links.get(11, p.tournament_account), links.get(12, p.main_account)])
+            if names_stale:
+                value_cells.append((r, "KLM", [p.discord, p.tournament_account, p.main_account]))
+            # Columns N and P are left untouched, so the rest of the row is two ranges
+            value_cells.append((r, "O", [p.peak_rank]))
+            value_cells.append((r, "QR", [p.current_rank, p.total_lp]))
+            
+            if links and (names_stale or not _cells_match(current, TEAM_START, r, "LM",
+                                                           [links.get(11, p.tournament_account), links.get(12, p.main_account)])):
+                player_links.append((r, links))
         
-        worksheet.batch_update(updates)
+        all_value_updates.extend(
+            {"range": _cell_range(r, cols), "values": [values]}
+            for r, cols, values in value_cells
+            if not _cells_match(current, TEAM_START, r, cols, values)
+        )
         
         # Formula updates (logo + hyperlinks)
-        formula_reqs = []
-        
         # Logo handling: Image formula OR text fallback
         logo_url = convert_drive_url(team.logo_url)
         if logo_url:
             # It's an image
-            formula_reqs.append({
-                "updateCells": {
-                    "range": {"sheetId": sheet_id, "startRowIndex": row-1, "endRowIndex": row,
-                              "startColumnIndex": 6, "endColumnIndex": 7},
-                    "rows": [{"values": [{"userEnteredValue": {"formulaValue": f'=IMAGE("{logo_url}")'}}]}],
-                    "fields": "userEnteredValue",
-                }
-            })
-        else:
+            if not _cells_match(current, TEAM_START, row, "G", [f'=IMAGE("{logo_url}")']):
+                all_formula_reqs.append(_mk_cell(sheet_id, row, 6, [{"formulaValue": f'=IMAGE("{logo_url}")'}]))
+        elif not _cells_match(current, TEAM_START, row, "G", [f"[{team.short_name}]"]):
             # Fallback: short name as text
             # We use updateCells here to overwrite any previous IMAGE formula with a string
-            formula_reqs.append({
-                "updateCells": {
-                    "range": {"sheetId": sheet_id, "startRowIndex": row-1, "endRowIndex": row,
-                              "startColumnIndex": 6, "endColumnIndex": 7},
-                    "rows": [{"values": [{"userEnteredValue": {"stringValue": f"[{team.short_name}]"}}]}],
-                    "fields": "userEnteredValue",
-                }
-            })
-        
-        for i, p in enumerate(team.players):
-            r = row + i
-            if p.opgg_tournament:
-                formula_reqs.append({
-                    "updateCells": {
-                        "range": {"sheetId": sheet_id, "startRowIndex": r-1, "endRowIndex": r,
-                                  "startColumnIndex": 11, "endColumnIndex": 12},
-                        "rows": [{"values": [{"userEnteredValue": 
-                            {"formulaValue": f'=HYPERLINK("{p.opgg_tournament}","{p.tournament_account.replace(chr(34), chr(39))}")'}}]}],
-                        "fields": "userEnteredValue",
-                    }
-                })
-            if p.opgg_main:
-                formula_reqs.append({
-                    "updateCells": {
-                        "range": {"sheetId": sheet_id, "startRowIndex": r-1, "endRowIndex": r,
-                                  "startColumnIndex": 12, "endColumnIndex": 13},
-                        "rows": [{"values": [{"userEnteredValue": 
-                            {"formulaValue": f'=HYPERLINK("{p.opgg_main}","{p.main_account.replace(chr(34), chr(39))}")'}}]}],
-                        "fields": "userEnteredValue",
-                    }
-                })
+            all_formula_reqs.append(_mk_cell(sheet_id, row, 6, [{"stringValue": f"[{team.short_name}]"}]))
         
-        if formula_reqs:
-            try:
-                sheets.spreadsheets().batchUpdate(
-                    spreadsheetId=TARGET_SHEET_ID, body={"requests": formula_reqs}
-                ).execute()
-            except Exception as e:
-                print(f"    Warning: {e}")
+        # Sent as one range when both links exist
+        all_formula_reqs.extend(
+            _mk_cell(sheet_id, r, min(links), [{"formulaValue": links[c]} for c in range(min(links), max(links) + 1)])
+            for r, links in player_links
+        )
         
-        time.sleep(0.3)
+        if len(all_value_updates) + len(all_formula_reqs) > pending:
+            print(f"  Updating team {idx}: {team.name}")
+    
+    if not all_value_updates and not all_formula_reqs:
+        print(f"\nNo changes for: {TARGET_SHEET_NAME}")
+        return
+    
+    if all_value_updates:
+        worksheet.batch_update(all_value_updates)
     
-    print(f"\nData written to: {TARGET_SHEET_NAME}")
+    if all_formula_reqs:
+        try:
+            sheets.spreadsheets().batchUpdate(
+                spreadsheetId=TARGET_SHEET_ID, body={"requests": all_formula_reqs}
+            ).execute()
+        except Exception as e:
+            print(f"    Warning: {e}")
+    
+    print(f"\nData written to: {TARGET_SHEET_NAME} "
+          f"({len(all_value_updates)} value ranges, {len(all_formula_reqs)} formula ranges changed)")
 
 # ============================================================================
 # MAIN
@@ -534,25 +673,46 @@ def main():
     
     print("\n[1/4] Authenticating...")
     creds = get_credentials()
+    # One gspread client and one Sheets API client (bundled discovery doc) for the whole run
+    gc = gspread.authorize(creds)
+    sheets = build('sheets', 'v4', credentials=creds, cache_discovery=False, static_discovery=True)
     
     print("\n[2/4] Reading form responses...")
-    teams = read_teams(creds)
+    teams = read_teams(sheets)
     print(f"  Found {len(teams)} teams")
     
     print("\n[3/4] Fetching player data...")
+    load_cache()
+    # Empty slots keep their defaults (0 LP), so they can be left out entirely
+    players = [p for team in teams for p in team.players if p.main_account.strip()]
+    print(f"  {len(players)} filled player slots")
+    # Resolve each distinct account once, even if it's listed in several slots or teams
+    accounts = {}
+    for p in players:
+        for account in (p.main_account, p.tournament_account):
+            key = _account_key(account)
+            # Prefer a form that names the region (OP.GG URL or "(region)" hint)
+            if key and (key not in accounts or (_parse_account(account)[2] and not _parse_account(accounts[key])[2])):
+                accounts[key] = account
+    # Lookups are pure network I/O, so fan them out across all teams at once
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as pool:
+        lookups = dict(zip(accounts, pool.map(_lookup_account, accounts.values())))
+    save_cache()
+    print(f"  Looked up {len(accounts)} unique accounts")
+    
     for team in teams:
         print(f"\n{team.name}:")
         for player in team.players:
-            fetch_player(player)
-            time.sleep(0.2)
-        team.regular_score = sum(p.total_lp for p in team.players[:5])
-        team.total_score = sum(p.total_lp for p in team.players)
+            fetch_player(player, lookups)
+        lps = [p.total_lp for p in team.players]
+        team.regular_score = sum(lps[:5])
+        team.total_score = sum(lps)
         print(f"  Scores: Regular={team.regular_score}, Total={team.total_score}")
     
     teams.sort(key=lambda t: t.regular_score, reverse=True)
     
     print("\n[4/4] Writing to Google Sheets...")
-    write_teams(creds, teams)
+    write_teams(gc, sheets, teams)
     
     print("\n" + "=" * 60)
     print("Done!")